@@ -11,37 +11,169 @@ Exit codes:
     1 - One or more tests failed
 """
 
+import asyncio
 import csv
+import hashlib
+import json
 import sys
 import os
 import argparse
+import re
+import time
+from collections.abc import Iterator
+from functools import lru_cache
 from pathlib import Path
 
 try:
     import anthropic
+    import httpx  # Ships with the anthropic SDK
 except ImportError:
     print("Error: anthropic package not installed.")
     print("Run: pip install anthropic")
     sys.exit(1)
 
+try:
+    import ahocorasick  # Optional: pip install pyahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson  # Optional: C-accelerated JSON for the results log
+except ImportError:
+    orjson = None
+
+
+def _dump_record(record: dict) -> bytes:
+    """Serialize one results-log record to JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(record)
+    return json.dumps(record).encode()
+
 
 def check_api_key() -> bool:
     """Check if ANTHROPIC_API_KEY is set."""
     return bool(os.environ.get("ANTHROPIC_API_KEY"))
 
 
+@lru_cache(maxsize=None)
 def load_prompt_template(path: str) -> str:
-    """Load the prompt template from a file."""
+    """Load the prompt template from a file (cached per path)."""
     return Path(path).read_text()
 
 
+# Matches {{VARIABLE}} placeholders; compiled once so fill_template is a
+# single O(template) pass instead of one str.replace scan per variable.
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
+
 def fill_template(template: str, variables: dict) -> str:
     """Replace {{VARIABLE}} placeholders with values."""
-    result = template
-    for key, value in variables.items():
-        placeholder = f"{{{{{key}}}}}"
-        result = result.replace(placeholder, value or "")
-    return result
+    def _sub(match: re.Match) -> str:
+        key = match.group(1)
+        if key in variables:
+            return variables[key] or ""
+        return match.group(0)  # Leave unknown placeholders untouched
+
+    return _PLACEHOLDER_RE.sub(_sub, template)
+
+
+def build_messages(template: str, variables: dict) -> tuple[list, str]:
+    """
+    Build the user message for one test case, marking the static template
+    prefix (everything before the first placeholder) with cache_control
+    so the API's prompt cache serves it at 10% input cost across rows.
+
+    Returns: (messages, filled_prompt) — the filled prompt is the full
+    prompt text, used for display and response-cache keys.
+    """
+    match = _PLACEHOLDER_RE.search(template)
+    prefix = template[:match.start()] if match else template
+    suffix = fill_template(template[len(prefix):], variables)
+    prompt = prefix + suffix
+
+    if not prefix or not suffix:
+        return [{"role": "user", "content": prompt}], prompt
+
+    return [{
+        "role": "user",
+        "content": [
+            {"type": "text", "text": prefix,
+             "cache_control": {"type": "ephemeral"}},
+            {"type": "text", "text": suffix},
+        ],
+    }], prompt
+
+
+def _cache_path(cache_dir: Path, model: str, prompt: str) -> Path:
+    """Cache file for an exact (model, prompt) pair.
+
+    blake2b is ~2x faster than sha256 in hashlib for short inputs.
+    """
+    key = hashlib.blake2b(f"{model}\x00{prompt}".encode()).hexdigest()
+    return cache_dir / f"{key}.json"
+
+
+def cache_get(cache_dir: Path, model: str, prompt: str) -> str | None:
+    """Return the cached response text for (model, prompt), or None on miss."""
+    path = _cache_path(cache_dir, model, prompt)
+    try:
+        return json.loads(path.read_text())["actual"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+
+def cache_put(cache_dir: Path, model: str, prompt: str, actual: str) -> None:
+    """Atomically store a response so concurrent writers can't corrupt entries."""
+    path = _cache_path(cache_dir, model, prompt)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps({"model": model, "actual": actual}))
+    os.replace(tmp, path)
+
+
+def iter_cases(dataset_path: str) -> Iterator[tuple[dict, str]]:
+    """
+    Stream (variables, expected_output) pairs from the dataset CSV.
+
+    Reads the file in a single pass with csv.reader and a precomputed
+    column-index map, skipping DictReader's per-row dict/zip machinery.
+    """
+    with open(dataset_path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        exp_idx = header.index('expected_output') if 'expected_output' in header else -1
+        var_indices = [(h, i) for i, h in enumerate(header) if i != exp_idx]
+        for row in reader:
+            expected = row[exp_idx] if 0 <= exp_idx < len(row) else ''
+            # Short rows get None for missing columns, like DictReader's restval
+            yield {h: (row[i] if i < len(row) else None) for h, i in var_indices}, expected
+
+
+# Matchers are cached per `expected` string: the same assertion is often
+# checked across many rows (and across cache-hit re-runs).
+_automaton_cache: dict = {}
+_expected_re_cache: dict = {}
+
+
+def _build_automaton(expected: str):
+    """Build (and cache) an Aho-Corasick automaton over the pipe-alternatives.
+
+    Returns None when any alternative is empty after stripping: add_word("")
+    is a silent no-op and an automaton with no words can't be searched, and
+    an empty alternative matches any output anyway (vacuous pass).
+    """
+    if expected in _automaton_cache:
+        return _automaton_cache[expected]
+
+    alternatives = [alt.strip() for alt in expected.split("|")]
+    if "" in alternatives:
+        automaton = None
+    else:
+        automaton = ahocorasick.Automaton()
+        for alt in alternatives:
+            automaton.add_word(alt.lower(), alt)
+        automaton.make_automaton()
+    _automaton_cache[expected] = automaton
+    return automaton
 
 
 def check_output(actual: str, expected: str) -> tuple[bool, str]:
@@ -51,23 +183,57 @@ def check_output(actual: str, expected: str) -> tuple[bool, str]:
     Supports multiple alternatives with pipe separator: "option1|option2|option3"
     Passes if ANY alternative matches (OR logic).
 
+    When pyahocorasick is installed, all alternatives are matched in a
+    single scan of the output; otherwise falls back to one substring
+    scan per alternative.
+
     Returns: (passed, matched_term or None)
     """
     if not expected:
         return True, None  # No expectation = always pass
 
-    actual_lower = actual.lower()
-
-    # Support multiple alternatives with | separator
-    alternatives = [alt.strip() for alt in expected.split("|")]
-
-    for alt in alternatives:
-        if alt.lower() in actual_lower:
+    if ahocorasick is not None:
+        automaton = _build_automaton(expected)
+        if automaton is None:
+            return True, ''  # An empty alternative matches any output
+        for _, alt in automaton.iter(actual.lower()):
             return True, alt
-
+        return False, None
+
+    # Fallback: one case-insensitive alternation search. IGNORECASE lets
+    # the regex engine match without allocating lowercased copies of the
+    # response and each alternative. Each alternative gets its own group
+    # so the match maps back to the expected-side term, like the
+    # Aho-Corasick path.
+    cached = _expected_re_cache.get(expected)
+    if cached is None:
+        alternatives = [alt.strip() for alt in expected.split("|")]
+        if "" in alternatives:
+            pattern = None  # An empty alternative matches any output
+        else:
+            pattern = re.compile(
+                "|".join(f"({re.escape(alt)})" for alt in alternatives),
+                re.IGNORECASE)
+        cached = (pattern, alternatives)
+        _expected_re_cache[expected] = cached
+    pattern, alternatives = cached
+
+    if pattern is None:
+        return True, ''
+    match = pattern.search(actual)
+    if match:
+        return True, alternatives[match.lastindex - 1]
     return False, None
 
 
+# Compiled fast paths for the two per-row string helpers, worth it on
+# multi-million-row datasets. Build with: python setup.py build_ext --inplace
+try:
+    from fast_eval import fill_template, check_output
+except ImportError:
+    pass  # Pure-Python implementations above remain in effect
+
+
 def dry_run_evals(dataset_path: str, prompt_path: str) -> int:
     """
     Preview what tests would run without calling the API.
@@ -77,97 +243,285 @@ def dry_run_evals(dataset_path: str, prompt_path: str) -> int:
     template = load_prompt_template(prompt_path)
     total = 0
 
-    with open(dataset_path, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
+    for variables, expected in iter_cases(dataset_path):
+        total += 1
 
-        for row in reader:
-            total += 1
-            expected = row.pop('expected_output', '')
-            variables = row
-
-            # Show test case info
-            print(f"\n{'='*50}")
-            print(f"Test {total}")
-            print(f"{'='*50}")
-            print(f"Variables:")
-            for key, value in variables.items():
-                preview = (value[:50] + '...') if value and len(value) > 50 else (value or '(empty)')
-                print(f"  {key}: {preview}")
-            print(f"Expected output contains: {expected or '(no assertion)'}")
-
-            # Show filled prompt preview
-            prompt = fill_template(template, variables)
-            prompt_preview = prompt[:200] + '...' if len(prompt) > 200 else prompt
-            print(f"\nPrompt preview:")
-            print(f"  {prompt_preview}")
+        # Show test case info
+        print(f"\n{'='*50}")
+        print(f"Test {total}")
+        print(f"{'='*50}")
+        print(f"Variables:")
+        for key, value in variables.items():
+            preview = (value[:50] + '...') if value and len(value) > 50 else (value or '(empty)')
+            print(f"  {key}: {preview}")
+        print(f"Expected output contains: {expected or '(no assertion)'}")
+
+        # Show filled prompt preview
+        prompt = fill_template(template, variables)
+        prompt_preview = prompt[:200] + '...' if len(prompt) > 200 else prompt
+        print(f"\nPrompt preview:")
+        print(f"  {prompt_preview}")
 
     return total
 
 
-def run_evals(dataset_path: str, prompt_path: str, model: str = "claude-sonnet-4-20250514") -> tuple[int, int, list]:
+# How many completed tests between console progress lines.
+_PROGRESS_EVERY = 25
+
+
+async def run_evals(dataset_path: str, prompt_path: str, model: str = "claude-sonnet-4-20250514",
+                    concurrency: int = 8, cache_dir: Path | None = None,
+                    results_path: str = "results.jsonl", threshold: int = 0) -> tuple[int, int, list]:
     """
-    Run all evals from the dataset.
+    Run all evals from the dataset, issuing up to `concurrency` API calls in parallel.
+
+    With cache_dir set, responses are cached on disk by (model, prompt)
+    hash so re-runs with an unchanged prompt skip the API entirely.
+    Per-test outcomes are written as NDJSON to results_path.
+
+    With threshold > 0, the run aborts as soon as enough failures have
+    accumulated that the pass rate can no longer reach threshold%, saving
+    the remaining API calls on broken prompt iterations.
+
+    Returns: (passed_count, total_count, failures_list) — total counts
+    every dataset row even when the run aborts early, so the pass rate
+    reflects the aborted run.
+    """
+    # One pooled HTTP/2 connection multiplexes all concurrent requests,
+    # so only the first call pays TLS setup.
+    client = anthropic.AsyncAnthropic(
+        http_client=httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64)))
+    template = load_prompt_template(prompt_path)
+
+    if cache_dir is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+
+    async def _one(messages: list, prompt: str) -> str:
+        if cache_dir is not None:
+            cached = cache_get(cache_dir, model, prompt)
+            if cached is not None:
+                return cached
+
+        # Call the API with temperature=0 for deterministic outputs
+        response = await client.messages.create(
+            model=model,
+            max_tokens=1024,
+            temperature=0,  # Deterministic outputs for consistent evals
+            messages=messages
+        )
+        actual = response.content[0].text
+
+        if cache_dir is not None:
+            cache_put(cache_dir, model, prompt, actual)
+        return actual
+
+    # Early-abort bookkeeping needs the row count up front; one extra CSV
+    # pass is cheap next to even a single API call.
+    total_rows = sum(1 for _ in iter_cases(dataset_path))
+
+    # Producer/consumer pipeline: rows are parsed and their templates
+    # filled while earlier requests are already in flight. The bounded
+    # queue keeps parsing from outrunning the concurrency window, and the
+    # worker count bounds in-flight API calls.
+    queue: asyncio.Queue = asyncio.Queue(maxsize=64)
+    cases: dict[int, tuple[dict, str]] = {}   # index -> (variables, expected)
+    results: dict[int, object] = {}           # index -> actual text or exception
+    checks: dict[int, tuple] = {}             # index -> (is_pass, matched)
+    snippets: dict[int, str] = {}             # index -> truncated response
+    abort = asyncio.Event()
+    completed = 0
+    passed_so_far = 0
+
+    def _account(i: int, log) -> None:
+        # Per-completion bookkeeping: check the response, stream its
+        # record to the structured log, emit the periodic console
+        # summary, and stop the run once the threshold is arithmetically
+        # out of reach.
+        nonlocal completed, passed_so_far
+        completed += 1
+        variables, expected = cases[i]
+        result = results[i]
+        test_name = f"Test {i + 1}"
+
+        if isinstance(result, BaseException):
+            log.write(_dump_record({
+                "test": test_name,
+                "pass": False,
+                "error": str(result),
+                "variables": variables
+            }) + b"\n")
+        else:
+            is_pass, matched = checks[i] = check_output(result, expected)
+            if is_pass:
+                passed_so_far += 1
+            # One truncated copy serves both the log and the failure record
+            snippets[i] = result if len(result) <= 500 else result[:500]
+            log.write(_dump_record({
+                "test": test_name,
+                "pass": is_pass,
+                "matched": matched,
+                "expected": expected,
+                "actual": snippets[i]
+            }) + b"\n")
+
+        if completed % _PROGRESS_EVERY == 0 or completed == total_rows:
+            print(f"  {completed}/{total_rows} completed, "
+                  f"{passed_so_far} passed, {completed - passed_so_far} failed")
+
+        # Only abort while rows remain to be saved; a finished run that
+        # merely missed the threshold is reported normally by main.
+        best_case = (passed_so_far + total_rows - completed) * 100 // total_rows
+        if threshold > 0 and best_case < threshold and completed < total_rows:
+            abort.set()
+
+    async def _produce() -> None:
+        for i, (variables, expected) in enumerate(iter_cases(dataset_path)):
+            if abort.is_set():
+                break
+            cases[i] = (variables, expected)
+            await queue.put((i, build_messages(template, variables)))
+        for _ in range(concurrency):
+            await queue.put(None)  # One stop sentinel per worker
+
+    async def _work(log) -> None:
+        while (item := await queue.get()) is not None:
+            if abort.is_set():
+                continue  # Drain the queue without dispatching
+            i, (messages, prompt) = item
+            try:
+                results[i] = await _one(messages, prompt)
+            except Exception as e:
+                results[i] = e
+            _account(i, log)
+
+    # Per-test details stream to the structured log as they complete; the
+    # console only gets a periodic summary so stdout isn't a
+    # serialization point on big runs.
+    with open(results_path, "wb") as log:
+        try:
+            await asyncio.gather(_produce(), *[_work(log) for _ in range(concurrency)])
+        finally:
+            await client.close()
+
+    # In-flight calls still finish after the abort fires, so re-check that
+    # rows were actually skipped before claiming an early stop.
+    if abort.is_set() and completed < total_rows:
+        print(f"Aborted early after {completed}/{total_rows} tests: "
+              f"pass rate can no longer reach the {threshold}% threshold")
+
+    # Logging and progress already happened per completion in _account;
+    # this pass just assembles the summary in dataset order.
+    passed = 0
+    failures = []
+
+    for i in sorted(results):
+        variables, expected = cases[i]
+        result = results[i]
+        test_name = f"Test {i + 1}"
+
+        if isinstance(result, BaseException):
+            failures.append({
+                "test": test_name,
+                "error": str(result),
+                "variables": variables
+            })
+        elif checks[i][0]:
+            passed += 1
+        else:
+            failures.append({
+                "test": test_name,
+                "expected": expected,
+                "actual": snippets[i],
+                "variables": variables
+            })
+
+    print(f"Per-test results written to {results_path}")
+    return passed, total_rows, failures
+
+
+def run_evals_batch(dataset_path: str, prompt_path: str, model: str = "claude-sonnet-4-20250514",
+                    poll_interval: float = 30.0) -> tuple[int, int, list]:
+    """
+    Run all evals through the Message Batches API.
+
+    Batches process asynchronously at 50% cost with separate throughput
+    limits, so this is the right mode for offline golden-dataset runs
+    where latency doesn't matter.
 
     Returns: (passed_count, total_count, failures_list)
     """
     client = anthropic.Anthropic()
     template = load_prompt_template(prompt_path)
-    
+
+    cases = {}  # custom_id -> (variables, expected)
+    requests = []
+
+    for i, (variables, expected) in enumerate(iter_cases(dataset_path)):
+        custom_id = f"test-{i}"
+        cases[custom_id] = (variables, expected)
+        messages, _ = build_messages(template, variables)
+        requests.append({
+            "custom_id": custom_id,
+            "params": {
+                "model": model,
+                "max_tokens": 1024,
+                "temperature": 0,
+                "messages": messages
+            }
+        })
+
+    batch = client.messages.batches.create(requests=requests)
+    print(f"Submitted batch {batch.id} with {len(requests)} request(s)")
+
+    while batch.processing_status != "ended":
+        time.sleep(poll_interval)
+        batch = client.messages.batches.retrieve(batch.id)
+        counts = batch.request_counts
+        print(f"  Batch {batch.processing_status}: "
+              f"{counts.succeeded} succeeded, {counts.errored} errored, "
+              f"{counts.processing} processing")
+
     passed = 0
     total = 0
     failures = []
-    
-    with open(dataset_path, newline='', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        
-        for row in reader:
-            total += 1
-            test_name = f"Test {total}"
-            
-            # Separate expected_output from variables
-            expected = row.pop('expected_output', '')
-            variables = row
-            
-            # Fill the template
-            prompt = fill_template(template, variables)
-            
-            # Call the API with temperature=0 for deterministic outputs
-            try:
-                response = client.messages.create(
-                    model=model,
-                    max_tokens=1024,
-                    temperature=0,  # Deterministic outputs for consistent evals
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                actual = response.content[0].text
-            except Exception as e:
-                print(f"✗ {test_name}: API ERROR - {e}")
-                failures.append({
-                    "test": test_name,
-                    "error": str(e),
-                    "variables": variables
-                })
-                continue
-
-            # Check the result
-            is_pass, matched = check_output(actual, expected)
-            if is_pass:
-                passed += 1
-                if matched:
-                    print(f"✓ {test_name}: PASSED (matched: {matched})")
-                else:
-                    print(f"✓ {test_name}: PASSED")
+
+    for entry in client.messages.batches.results(batch.id):
+        total += 1
+        variables, expected = cases[entry.custom_id]
+        test_name = entry.custom_id
+
+        if entry.result.type != "succeeded":
+            print(f"✗ {test_name}: BATCH ERROR - {entry.result.type}")
+            failures.append({
+                "test": test_name,
+                "error": entry.result.type,
+                "variables": variables
+            })
+            continue
+        actual = entry.result.message.content[0].text
+
+        is_pass, matched = check_output(actual, expected)
+        if is_pass:
+            passed += 1
+            if matched:
+                print(f"✓ {test_name}: PASSED (matched: {matched})")
             else:
-                print(f"✗ {test_name}: FAILED")
-                print(f"  Expected to contain: {expected}")
-                print(f"  Got: {actual[:300]}{'...' if len(actual) > 300 else ''}")
-                failures.append({
-                    "test": test_name,
-                    "expected": expected,
-                    "actual": actual[:500],
-                    "variables": variables
-                })
-    
+                print(f"✓ {test_name}: PASSED")
+        else:
+            print(f"✗ {test_name}: FAILED")
+            print(f"  Expected to contain: {expected}")
+            # One truncated copy serves both the print and the failure record
+            snippet = actual if len(actual) <= 500 else actual[:500]
+            print(f"  Got: {snippet[:300]}{'...' if len(actual) > 300 else ''}")
+            failures.append({
+                "test": test_name,
+                "expected": expected,
+                "actual": snippet,
+                "variables": variables
+            })
+
     return passed, total, failures
 
 
@@ -177,6 +531,15 @@ def main():
     parser.add_argument("--prompt", default="prompt.txt", help="Path to prompt template")
     parser.add_argument("--model", default="claude-sonnet-4-20250514", help="Model to use")
     parser.add_argument("--dry-run", action="store_true", help="Preview tests without calling the API")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Maximum number of API calls in flight at once (default: 8)")
+    parser.add_argument("--batch", action="store_true",
+                        help="Submit all tests via the Message Batches API (50%% cost, async processing)")
+    parser.add_argument("--results", default="results.jsonl", metavar="FILE",
+                        help="Where to write per-test NDJSON results (default: results.jsonl)")
+    parser.add_argument("--cache-dir", default=None, metavar="DIR",
+                        help="Cache API responses on disk (e.g. .eval_cache) so "
+                             "re-runs with unchanged prompts skip the API")
     parser.add_argument("--threshold", type=int, default=100,
                         help="Minimum pass rate %% to succeed (default: 100). Use 80-90 for flaky tests.")
     args = parser.parse_args()
@@ -223,9 +586,16 @@ def main():
     print(f"  Prompt:    {args.prompt}")
     print(f"  Model:     {args.model}")
     print(f"  Threshold: {args.threshold}%")
+    print(f"  Concurrency: {args.concurrency}")
     print("-" * 40)
 
-    passed, total, failures = run_evals(args.dataset, args.prompt, args.model)
+    if args.batch:
+        passed, total, failures = run_evals_batch(args.dataset, args.prompt, args.model)
+    else:
+        cache_dir = Path(args.cache_dir) if args.cache_dir else None
+        passed, total, failures = asyncio.run(
+            run_evals(args.dataset, args.prompt, args.model, args.concurrency, cache_dir,
+                      args.results, args.threshold))
 
     print("-" * 40)
     pass_rate = 100 * passed // total if total > 0 else 0
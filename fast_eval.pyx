@@ -0,0 +1,76 @@
+# cython: language_level=3
+"""
+Compiled fast paths for eval_runner's per-row string helpers.
+
+Optional: build with `python setup.py build_ext --inplace` (requires
+Cython). eval_runner falls back to its pure-Python implementations when
+this module isn't built. Semantics must stay identical to the Python
+versions in eval_runner.py.
+"""
+
+
+cdef bint _is_word_key(str key):
+    """Mirror the \\w+ placeholder grammar of eval_runner's regex."""
+    if not key:
+        return False
+    for ch in key:
+        if not (ch.isalnum() or ch == "_"):
+            return False
+    return True
+
+
+def fill_template(str template, dict variables):
+    """Replace {{VARIABLE}} placeholders with values in one pass."""
+    cdef list parts = []
+    cdef Py_ssize_t pos = 0, start, end
+    cdef str key
+
+    while True:
+        start = template.find("{{", pos)
+        if start == -1:
+            parts.append(template[pos:])
+            break
+        end = template.find("}}", start + 2)
+        if end == -1:
+            parts.append(template[pos:])
+            break
+        key = template[start + 2:end]
+        if not _is_word_key(key):
+            # Not a {{WORD}} placeholder; step one char like the regex
+            # scan so e.g. "{{{NAME}}}" still finds the inner placeholder
+            parts.append(template[pos:start + 1])
+            pos = start + 1
+        elif key in variables:
+            parts.append(template[pos:start])
+            parts.append(variables[key] or "")
+            pos = end + 2
+        else:
+            # Leave unknown placeholders untouched
+            parts.append(template[pos:start + 2])
+            pos = start + 2
+
+    return "".join(parts)
+
+
+def check_output(str actual, str expected):
+    """Check if actual contains any pipe-separated alternative of expected."""
+    if not expected:
+        return True, None
+
+    cdef list alternatives = []
+    cdef str alt
+
+    for alt in expected.split("|"):
+        alt = alt.strip()
+        if not alt:
+            # An empty alternative matches any output; report it the same
+            # way as the Python implementations
+            return True, ""
+        alternatives.append(alt)
+
+    cdef str actual_lower = actual.lower()
+    for alt in alternatives:
+        if alt.lower() in actual_lower:
+            return True, alt
+
+    return False, None
@@ -0,0 +1,9 @@
+"""Builds the optional fast_eval extension: python setup.py build_ext --inplace"""
+
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="fast-eval",
+    ext_modules=cythonize("fast_eval.pyx"),
+)